@@ -11,6 +11,7 @@ from scipy.stats import pearsonr
 from generate_targeted_triplets_eval_sets import load_data, get_lemmatized_words, WORDS_NAMES, FRAGMENTS, POS_TAGS
 from pig.data import DEFAULT_SAMPLE_RATE
 from pig.evaluation import load_best_model
+from pig.models import quantized_for_cpu
 
 import pytorch_lightning as pl
 import logging
@@ -31,11 +32,24 @@ NUM_WORKERS = 8
 RESULT_DIR = "results/targeted_triplets"
 
 
-def evaluate(model):
-    """Compute the targeted triplets score for the given model. """
+def evaluate(model, quantize=False):
+    """Compute the targeted triplets score for the given model. With
+    `quantize`, a model evaluated on CPU has its frozen wav2vec encoder
+    quantized to int8; the `quantized` column of the results records it."""
     gpus = None
+    quantized = False
     if torch.cuda.is_available():
         gpus = 1
+        if quantize:
+            logging.info("Running on GPU, not quantizing the model")
+    elif quantize:
+        quantized_model = quantized_for_cpu(model)
+        quantized = quantized_model is not model
+        model = quantized_model
+        if quantized:
+            logging.info("Scoring with the wav2vec encoder quantized to int8; scores will differ from unquantized runs")
+        else:
+            logging.info("The wav2vec encoder was not frozen in training, not quantizing the model")
     trainer = pl.Trainer(logger=False, gpus=gpus)
 
     results_all = []
@@ -61,6 +75,7 @@ def evaluate(model):
             results_all.append(results_data)
 
     results_all = pd.concat(results_all, ignore_index=True)
+    results_all["quantized"] = quantized
     return results_all
 
 
@@ -70,7 +85,8 @@ def targeted_triplet_score(fragment_type, pos, model, trainer, scrambled_video):
                                            target_size=model.config["data"]["target_size"],
                                            audio_sample_rate=audio_sample_rate,
                                            scrambled_video=scrambled_video)
-    loader = DataLoader(ds, collate_fn=collate_triplets, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, shuffle=False)
+    loader = DataLoader(ds, collate_fn=collate_triplets, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, shuffle=False,
+                        pin_memory=True)
     if len(ds) == 0:
         return []
 
@@ -294,6 +310,8 @@ def get_args():
         help="Minimum number of test samples for a word to be included",
     )
     parser.add_argument("--correlate-predictors", action="store_true", default=False)
+    parser.add_argument("--quantize", action="store_true", default=False,
+                        help="On CPU, quantize a frozen wav2vec encoder to int8 for faster, approximate scoring")
 
     return parser.parse_args()
 
@@ -383,7 +401,7 @@ if __name__ == "__main__":
             logging.info(f"Evaluating version {version}")
             net, path = load_best_model(f"lightning_logs/version_{version}/")
 
-            result = evaluate(net)
+            result = evaluate(net, quantize=args.quantize)
             result_path = f"{RESULT_DIR}/version_{version}/minimal_pairs_scores.csv"
             os.makedirs(os.path.dirname(result_path), exist_ok=True)
             result.to_csv(result_path, index=False)
@@ -9,7 +9,7 @@ net.cuda()
 with torch.no_grad():
     audio_paths = glob.glob(f"data/out/realign/narration/ep_1/0/*.wav")
     loader = audiofile_loader(audio_paths)
-    emb = torch.cat([ net.encode_audio(batch.to(net.device)).squeeze(dim=1)
+    emb = torch.cat([ net.encode_audio(batch.to(net.device, non_blocking=True)).squeeze(dim=1)
                           for batch in loader ])
 
 print(f"Audio embedding tensor with shape: {emb.shape}")
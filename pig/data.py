@@ -1,6 +1,6 @@
 import torch
 import torch.utils
-from torch.utils.data import Dataset, IterableDataset, DataLoader
+from torch.utils.data import Dataset, IterableDataset, DataLoader, Sampler
 
 
 from dataclasses import dataclass
@@ -8,7 +8,9 @@ import glob
 import os.path
 import pig.preprocess 
 import moviepy.editor as m
+import imageio_ffmpeg
 import pytorch_lightning as pl
+from pytorch_lightning.utilities.apply_func import apply_to_collection, move_data_to_device
 import logging
 import pig.util
 import json
@@ -16,6 +18,11 @@ import pickle
 from typing import Union
 import os.path
 import math
+import functools
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 SPLIT_SPEC = {'dialog': {'train': range(1, 197),
                          'val': range(197, 210),
@@ -54,21 +61,35 @@ class ClipBatch:
     video_duration: torch.tensor
     audio_duration: torch.tensor
 
+    def pin_memory(self):
+        """Called by DataLoader when `pin_memory=True`."""
+        return ClipBatch(video=self.video.pin_memory(),
+                         audio=self.audio.pin_memory() if self.audio is not None else None,
+                         video_duration=self.video_duration.pin_memory(),
+                         audio_duration=self.audio_duration.pin_memory())
+
 def collate_audio(data):
     return pig.util.pad_audio_batch(data)
 
 def collate(data):
-    video, audio, vlen, alen = zip(*[(x.video, x.audio, x.video_duration, x.audio_duration) for x in data])
-    return ClipBatch(video=pig.util.pad_video_batch(video),
-                     audio=pig.util.pad_audio_batch(audio),
-                     video_duration = torch.tensor(vlen),
-                     audio_duration = torch.tensor(alen))
+    return ClipBatch(video=pig.util.pad_video_batch([x.video for x in data]),
+                     audio=pig.util.pad_audio_batch([x.audio for x in data]),
+                     video_duration = torch.tensor([x.video_duration for x in data]),
+                     audio_duration = torch.tensor([x.audio_duration for x in data]))
+
+def collate_video(data):
+    """Like `collate`, but leaves out the audio, for when only the video
+    needs encoding."""
+    return ClipBatch(video=pig.util.pad_video_batch([x.video for x in data]),
+                     audio=None,
+                     video_duration = torch.tensor([x.video_duration for x in data]),
+                     audio_duration = torch.tensor([x.audio_duration for x in data]))
 
 def featurize(clip, audio_sample_rate):
-    frames = [ torch.tensor(frame/255).float()
-               for frame in clip.iter_frames() ]
+    frames = list(clip.iter_frames())
     if len(frames) > 0:
-        v = torch.stack(frames)
+        # Video stays uint8; conversion to float happens in the model's input normalization.
+        v = torch.from_numpy(np.stack(frames))
         return Clip(video = v.permute(3, 0, 1, 2),
                     audio = featurize_audio(clip.audio, audio_sample_rate),
                     video_duration = clip.duration,
@@ -77,12 +98,57 @@ def featurize(clip, audio_sample_rate):
     else:
         raise ValueError("Clip has zero frames.")
 
+@functools.lru_cache(maxsize=None)
+def load_line_meta(path):
+    """Subtitle metadata stored next to the video file at `path`; read once
+    per process, as the same files are revisited every epoch."""
+    i = os.path.splitext(os.path.basename(path))[0]
+    return json.load(open(f"{os.path.dirname(path)}/{i}.json"))
+
+def frame_indices(fps, start, end, nframes):
+    """Indices of the frames moviepy's `subclip(start, end).iter_frames()`
+    returns, clipped to the `nframes` actually decoded unless it is None."""
+    t = start + np.arange(0, end - start, 1.0/fps)
+    indices = (fps * t + 0.00001).astype(np.int64)
+    return indices if nframes is None else np.minimum(indices, nframes - 1)
+
+def read_video(path):
+    """Start a single ffmpeg pass over the video file at `path`. Returns its
+    metadata and an iterator over raw rgb24 frames."""
+    reader = imageio_ffmpeg.read_frames(path)
+    return next(reader), reader
+
+def decode_frames(meta, reader, n=None):
+    """Stack the first `n` frames from `reader` (all, if `n` is None) into a
+    uint8 [T, H, W, 3] array, and stop ffmpeg."""
+    width, height = meta['size']
+    frames = np.frombuffer(b''.join(itertools.islice(reader, n)), dtype=np.uint8)
+    reader.close()
+    return frames.reshape(-1, height, width, 3)
+
+def decode_audio(path, fps=DEFAULT_SAMPLE_RATE):
+    """Reads the audio track of the file at `path` in a single ffmpeg pass,
+    as a mono float32 array at `fps` samples per second."""
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-loglevel', 'error', '-i', path,
+           '-vn', '-ac', '2', '-ar', str(fps), '-f', 'f32le', '-']
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    # Downmix by averaging, as featurize_audio does; ffmpeg's own -ac 1 scales by 1/sqrt(2).
+    return np.frombuffer(out, dtype=np.float32).reshape(-1, 2).mean(axis=1)
+
+def sample_indices(track_fps, start, end, samplerate, nsamples):
+    """Indices into a track decoded at `track_fps` of the samples moviepy's
+    `subclip(start, end).to_soundarray(fps=samplerate)` picks, clipped to the
+    `nsamples` actually decoded."""
+    t = start + (1.0/samplerate) * np.arange(int(samplerate * (end - start)))
+    return np.minimum(np.round(track_fps * t).astype(np.int64), nsamples - 1)
+
 def featurize_audio(clip, samplerate):
     # .to_soundarray extracts corrupted audio from small clips, 
     # but calling the function twice seems to fix the issue.
     clip.to_soundarray(fps=samplerate, buffersize=5000)
-    a = torch.tensor(clip.to_soundarray(fps=samplerate, buffersize=5000)).float()
-    return a.mean(dim=1, keepdim=True).permute(1,0)
+    snd = clip.to_soundarray(fps=samplerate, buffersize=5000)
+    # Downmix to mono and cast to float32 in one numpy reduction, laid out as [1, T].
+    return torch.from_numpy(snd.mean(axis=1, dtype=np.float32)).unsqueeze(0)
   
 class AudioFileDataset(IterableDataset):
 
@@ -136,40 +202,35 @@ class VideoClipDataset(IterableDataset):
         for clip in self.clips:
             yield featurize(clip, self.audio_sample_rate)
         
-class GenericIterableDataset(IterableDataset):
-    def __init__(self, items):
-        self.items = items
-
-    def __iter__(self):
-        yield from self.items
-
 def audiofile_loader(paths, batch_size=32, audio_sample_rate=DEFAULT_SAMPLE_RATE):
     dataset = AudioFileDataset(paths, audio_sample_rate)
-    return DataLoader(dataset, collate_fn=collate_audio, batch_size=batch_size)
+    return DataLoader(dataset, collate_fn=collate_audio, batch_size=batch_size, pin_memory=True)
 
 def grouped_audiofile_loader(paths, batch_size=32, audio_sample_rate=DEFAULT_SAMPLE_RATE):
     dataset = AudioFileDataset(paths, audio_sample_rate)
     loader = grouped_loader(dataset,
                             lambda x: x.shape[1],
                             collate_audio,
-                            batch_size)
+                            batch_size,
+                            pin_memory=True)
     return loader
     
 
 def audioarray_loader(arrays, batch_size=32):
     dataset = ArrayDataset(arrays)
-    return DataLoader(dataset, collate_fn=collate_audio, batch_size=batch_size)
+    return DataLoader(dataset, collate_fn=collate_audio, batch_size=batch_size, pin_memory=True)
 
 def audioclip_loader(clips, batch_size=32, audio_sample_rate=DEFAULT_SAMPLE_RATE):
     dataset = AudioClipDataset(clips, audio_sample_rate)
-    return DataLoader(dataset, collate_fn=collate_audio, batch_size=batch_size)
+    return DataLoader(dataset, collate_fn=collate_audio, batch_size=batch_size, pin_memory=True)
 
 def grouped_audioclip_loader(paths, batch_size=32, audio_sample_rate=DEFAULT_SAMPLE_RATE):
     dataset = AudioClipDataset(paths, audio_sample_rate)
     loader = grouped_loader(dataset,
                             lambda x: x.shape[1],
                             collate_audio,
-                            batch_size)
+                            batch_size,
+                            pin_memory=True)
     return loader
 
 def grouped_audioarray_loader(arrays, batch_size=32):
@@ -177,7 +238,8 @@ def grouped_audioarray_loader(arrays, batch_size=32):
     loader = grouped_loader(dataset,
                             lambda x: x.shape[1],
                             collate_audio,
-                            batch_size)
+                            batch_size,
+                            pin_memory=True)
     return loader
 
 class GroupedDataset(IterableDataset):
@@ -188,33 +250,161 @@ class GroupedDataset(IterableDataset):
         self.collate_fn = collate_fn
         self.batch_size = batch_size
 
+    def _items(self):
+        """Items grouped by this process. In a worker process, only the
+        worker's share of a map-style dataset is loaded. Iterable datasets
+        are expected to split themselves between workers, as
+        `PeppaPigIterableDataset` does; the others are read in full by every
+        worker, so should be loaded without worker processes."""
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is None or isinstance(self.dataset, IterableDataset) \
+           or not hasattr(self.dataset, '__getitem__'):
+            return self.dataset
+        return ( self.dataset[i] for i in range(worker_info.id, len(self.dataset), worker_info.num_workers) )
+
     def __iter__(self):
-        for _, items in pig.util.grouped(sorted(self.dataset, key=self.key), key=self.key):
-            yield from DataLoader(GenericIterableDataset(items),
-                                  collate_fn=self.collate_fn,
-                                  batch_size=self.batch_size)
+        # Bucket in one pass, then order only the distinct keys.
+        groups = sorted(pig.util.grouped(self._items(), key=self.key), key=lambda group: group[0])
+        batches = ( items[i:i+self.batch_size] for _, items in groups
+                    for i in range(0, len(items), self.batch_size) )
+        for batch in batches:
+            yield self.collate_fn(batch)
+
+class PrefetchLoader(DataLoader):
+    """DataLoader which copies the next batch to the current GPU on a side
+    CUDA stream while the current batch is being processed. Batches need to
+    be pinned (`pin_memory=True`) for the copies to overlap with compute."""
 
-def grouped_loader(dataset, key, collate_fn, batch_size=8):
+    def __iter__(self):
+        batches = super().__iter__()
+        if not torch.cuda.is_available():
+            yield from batches
+            return
+        device = torch.device('cuda', torch.cuda.current_device())
+        stream = torch.cuda.Stream(device)
+
+        def load(batch):
+            if batch is None:
+                return None
+            with torch.cuda.stream(stream):
+                return move_data_to_device(batch, device)
+
+        pending = load(next(batches, None))
+        while pending is not None:
+            torch.cuda.current_stream().wait_stream(stream)
+            batch = pending
+            # Memory allocated on the side stream is now used on the current one.
+            apply_to_collection(batch, torch.Tensor, lambda x: x.record_stream(torch.cuda.current_stream()))
+            pending = load(next(batches, None))
+            yield batch
+
+class BucketBatchSampler(Sampler):
+    """Batches of indices of items with equal key, in the same order as
+    `GroupedDataset`. `keys` holds the key of each item."""
+    def __init__(self, keys, batch_size):
+        groups = sorted(pig.util.grouped(range(len(keys)), key=keys.__getitem__), key=lambda group: group[0])
+        self.batches = [ indices[i:i+batch_size] for _, indices in groups
+                         for i in range(0, len(indices), batch_size) ]
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+def grouped_loader(dataset, key, collate_fn, batch_size=8, prefetch=False, **kwargs):
+    """Loader of batches of items with equal `key`. Remaining keyword
+    arguments such as `num_workers` or `pin_memory` go to the DataLoader."""
+    Loader = PrefetchLoader if prefetch else DataLoader
+    if hasattr(dataset, 'meta'):
+        # Keys are read from the index, so each worker only loads the items of its own batches.
+        sampler = BucketBatchSampler([ key(dataset.meta(i)) for i in range(len(dataset)) ], batch_size)
+        return Loader(dataset, batch_sampler=sampler, collate_fn=collate_fn, **kwargs)
     gds = GroupedDataset(dataset, key, collate_fn, batch_size=batch_size)
-    return DataLoader(gds, batch_size=None, batch_sampler=None) 
+    return Loader(gds, batch_size=None, batch_sampler=None, **kwargs)
             
+def materialize_cache(clips, directory):
+    """Write `clips` to `directory` as two shard files of raw uint8 video and
+    float32 audio, and return the index describing where each item is."""
+    index = []
+    video_offset = 0
+    audio_offset = 0
+    with open(f"{directory}/video.u8", "wb") as video_shard, \
+         open(f"{directory}/audio.f32", "wb") as audio_shard:
+        for i, item in enumerate(clips):
+            logging.info(f"Caching item {directory}/{i}")
+            video = item.video.numpy()
+            audio = item.audio.numpy()
+            video.tofile(video_shard)
+            audio.tofile(audio_shard)
+            index.append(dict(video_shape=list(video.shape),
+                              audio_shape=list(audio.shape),
+                              video_offset=video_offset,
+                              audio_offset=audio_offset,
+                              video_duration=item.video_duration,
+                              audio_duration=item.audio_duration,
+                              filename=item.filename,
+                              offset=item.offset,
+                              index=item.index))
+            video_offset += video.size
+            audio_offset += audio.size
+    json.dump(index, open(f"{directory}/index.json", "w"))
+    return index
+
+def open_cache(directory):
+    """Memory-map the video and audio shards of a cache written by
+    `materialize_cache`."""
+    return (np.memmap(f"{directory}/video.u8", dtype=np.uint8, mode='c'),
+            np.memmap(f"{directory}/audio.f32", dtype=np.float32, mode='c'))
+
+def load_cached_clip(shards, meta):
+    """Item described by `meta` as views into the memory-mapped `shards`."""
+    video_shard, audio_shard = shards
+    video_shape = tuple(meta['video_shape'])
+    audio_shape = tuple(meta['audio_shape'])
+    video = video_shard[meta['video_offset']:meta['video_offset'] + math.prod(video_shape)]
+    audio = audio_shard[meta['audio_offset']:meta['audio_offset'] + math.prod(audio_shape)]
+    return Clip(video=torch.from_numpy(video.reshape(video_shape)),
+                audio=torch.from_numpy(audio.reshape(audio_shape)),
+                video_duration=meta['video_duration'],
+                audio_duration=meta['audio_duration'],
+                filename=meta['filename'],
+                offset=meta['offset'],
+                index=meta['index'])
+
 class PeppaPigDataset(Dataset):
-    def __init__(self, force_cache=False, cache_dir=None, scrambled_video=False, **kwargs):
+    def __init__(self, force_cache=False, cache_dir=None, scrambled_video=False, cache_workers=None, **kwargs):
         dataset = PeppaPigIterableDataset(**kwargs)
         
         if cache_dir is None:
             self.cache_dir = f"data/out/items-{dataset.config_id()}/"
         else:
             self.cache_dir = cache_dir
-        if force_cache or not os.path.isdir(self.cache_dir):
+        if not force_cache and not os.path.isfile(f"{self.cache_dir}/index.json") \
+                           and len(glob.glob(f"{self.cache_dir}/*.pt")) > 0:
+            raise ValueError(f"{self.cache_dir} holds a cache in the old one-file-per-item format. "
+                             "Remove it or pass force_cache=True to rebuild it.")
+        if force_cache or not os.path.isfile(f"{self.cache_dir}/index.json") \
+                       or not os.path.isfile(f"{self.cache_dir}/video.u8"):
             os.makedirs(self.cache_dir, exist_ok=True)
             pickle.dump(kwargs, open(f"{self.cache_dir}/settings.pkl", "wb"))
-            for i, item in enumerate(dataset):
-                logging.info(f"Caching item {self.cache_dir}/{i}.pt")
-                torch.save(item, f"{self.cache_dir}/{i}.pt")
-        self.length = len(glob.glob(f"{self.cache_dir}/*.pt"))
+            # Files are decoded in parallel; the iterable dataset shards them between workers.
+            workers = min(8, os.cpu_count()) if cache_workers is None else cache_workers
+            loader = DataLoader(dataset, batch_size=None, num_workers=workers,
+                                **(dict(prefetch_factor=4) if workers > 0 else {}))
+            self.index = materialize_cache(loader, self.cache_dir)
+        else:
+            self.index = json.load(open(f"{self.cache_dir}/index.json"))
+        self.length = len(self.index)
         self.scrambled_video = scrambled_video
-        
+        self._shards = None
+
+    def __getstate__(self):
+        # Worker processes map the shards themselves.
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
     def __len__(self):
         return self.length
 
@@ -222,16 +412,31 @@ class PeppaPigDataset(Dataset):
         if idx >= self.length:
             raise IndexError("Index out of range")
         else:
-            item = torch.load(f"{self.cache_dir}/{idx}.pt")
+            if self._shards is None:
+                self._shards = open_cache(self.cache_dir)
+            item = load_cached_clip(self._shards, self.index[idx])
             if self.scrambled_video:
                 # Shuffle along temporal dimension
                 idx = torch.randperm(item.video.shape[1])
                 item.video = item.video[:, idx]
             return item
 
+    def meta(self, idx):
+        """Item `idx` without its video and audio, read from the index alone."""
+        meta = self.index[idx]
+        return Clip(video=None, audio=None,
+                    video_duration=meta['video_duration'],
+                    audio_duration=meta['audio_duration'],
+                    filename=meta['filename'],
+                    offset=meta['offset'],
+                    index=meta['index'])
+
     @classmethod
     def load(cls, directory):
-        return PeppaPigDataset(force_cache=False, cache_dir=directory)
+        """Dataset cached in `directory`, with the settings it was built with."""
+        settings = f"{directory}/settings.pkl"
+        kwargs = pickle.load(open(settings, "rb")) if os.path.isfile(settings) else {}
+        return PeppaPigDataset(force_cache=False, cache_dir=directory, **kwargs)
     
 class PeppaPigIterableDataset(IterableDataset):
     def __init__(self,
@@ -253,6 +458,7 @@ class PeppaPigIterableDataset(IterableDataset):
         self.jitter = jitter
         self.jitter_sd = jitter_sd
         self.split_spec = SPLIT_SPEC
+        self._paths = None
 
     def config_id(self):
         return "-".join([','.join(self.split),
@@ -263,23 +469,66 @@ class PeppaPigIterableDataset(IterableDataset):
                          f"{self.jitter},{self.jitter_sd}" if self.jitter else ""])
 
         
-    def featurize(self, clip):
-        return featurize(clip, self.audio_sample_rate)
-        
-    def _clips(self):
-        for clip in self._raw_clips():
-            try:
-                yield self.featurize(clip)
-            except ValueError as e:
-                logging.warning(f"{e}")
+    def _windows(self, path, duration):
+        """(start_v, end_v, start_a, end_a) of the video and audio of each
+        clip cut from the file at `path`, which lasts `duration` seconds."""
+        if self.duration is None:
+            meta = load_line_meta(path)
+            for begin, end in pig.preprocess.line_times(duration, meta, filename=path):
+                yield begin, end, begin, end
+        elif self.jitter:
+            yield from pig.preprocess.jitter_times(duration, duration=self.duration, sd=self.jitter_sd)
+        else:
+            for start, end in pig.preprocess.segment_times(duration, duration=self.duration):
+                yield start, end, start, end
 
-    def _raw_clips(self):
-        width,  height = self.target_size
-        paths = [ path for split in self.split \
-                       for episode_id in self.split_spec[self.fragment_type][split] \
-                       for path in glob.glob(f"data/out/{width}x{height}/{self.fragment_type}/{episode_id}/*.avi") ]
-        if len(paths) == 0:
-            raise RuntimeError(f"No clips found in data/out/{width}x{height}/{self.fragment_type}/ . Extract the data first.")
+    def _clips(self):
+        """Decodes the frames and audio track of each video file once and
+        slices clips out of them, instead of seeking for every subclip."""
+        for path in self._worker_paths():
+            meta, reader = read_video(path)
+            fps = meta['fps']
+            windows = [ (frame_indices(fps, start_v, end_v, None), end_v - start_v, start_a, end_a)
+                        for start_v, end_v, start_a, end_a in self._windows(path, meta['duration']) ]
+            needed = max((idx[-1] + 1 for idx, _, _, _ in windows if len(idx) > 0), default=0)
+            if needed == 0:
+                reader.close()
+                continue
+            # Frames after the last one any clip uses are never decoded.
+            frames = decode_frames(meta, reader, n=needed)
+            if len(frames) == 0:
+                logging.warning(f"{path} has zero frames.")
+                continue
+            # Decoded at moviepy's reader rate and subsampled like to_soundarray.
+            track = decode_audio(path, fps=DEFAULT_SAMPLE_RATE)
+            for idx, video_duration, start_a, end_a in windows:
+                if len(idx) == 0:
+                    logging.warning("Clip has zero frames.")
+                    continue
+                v = torch.from_numpy(frames[np.minimum(idx, len(frames) - 1)])
+                a = torch.from_numpy(track[sample_indices(DEFAULT_SAMPLE_RATE, start_a, end_a,
+                                                          self.audio_sample_rate, len(track))])
+                yield Clip(video = v.permute(3, 0, 1, 2),
+                           audio = a.unsqueeze(0),
+                           video_duration = video_duration,
+                           audio_duration = end_a - start_a,
+                           filename = path)
+
+    def paths(self):
+        """Returns the video files of the selected splits. The directories are
+        scanned on first use only."""
+        if self._paths is None:
+            width,  height = self.target_size
+            paths = [ path for split in self.split \
+                           for episode_id in self.split_spec[self.fragment_type][split] \
+                           for path in glob.glob(f"data/out/{width}x{height}/{self.fragment_type}/{episode_id}/*.avi") ]
+            if len(paths) == 0:
+                raise RuntimeError(f"No clips found in data/out/{width}x{height}/{self.fragment_type}/ . Extract the data first.")
+            self._paths = paths
+        return self._paths
+        
+    def _worker_paths(self):
+        paths = self.paths()
 
         # Split data between workers
         worker_info = torch.utils.data.get_worker_info()
@@ -292,12 +541,24 @@ class PeppaPigIterableDataset(IterableDataset):
             first = worker_id * per_worker
             last = min(first + per_worker, len(paths))
             logging.info(f"Workerid: {worker_id}; [{first}:{last}]")
-        for path in paths[first:last]:
+        return paths[first:last]
+
+    def durations(self):
+        """Durations of all clips, from the file headers and clip boundaries
+        alone, without decoding the files."""
+        def file_durations(path):
+            meta, reader = read_video(path)
+            reader.close()
+            return [ end_v - start_v for start_v, end_v, _, _ in self._windows(path, meta['duration']) ]
+        with ThreadPoolExecutor(os.cpu_count()) as pool:
+            return np.array([ d for ds in pool.map(file_durations, self.paths()) for d in ds ])
+
+    def _raw_clips(self):
+        for path in self._worker_paths():
             with m.VideoFileClip(path) as video:
             #logging.info(f"Path: {path}, size: {video.size}")
                 if self.duration is None:
-                    i = os.path.splitext(os.path.basename(path))[0]
-                    meta = json.load(open(f"{os.path.dirname(path)}/{i}.json"))
+                    meta = load_line_meta(path)
                     clips = pig.preprocess.lines(video, meta)
                 else:
                     clips = pig.preprocess.segment(video, duration=self.duration, jitter=self.jitter, jitter_sd=self.jitter_sd)
@@ -315,36 +576,46 @@ class Stats:
     audio_mean : torch.Tensor
     audio_std  : torch.Tensor
             
-def get_stats(loader):
-    """Compute means and standard deviations over data points from `loader`."""
-    # Mean pass
-    video_sum = torch.zeros(1,3,1,1,1).float()
-    video_count = torch.zeros(1,3,1,1,1).float()
-    audio_sum = torch.zeros(1,1,1).float()
-    audio_count = torch.zeros(1,1,1).float()
-    for batch in loader:
-         video_sum   += batch.video.sum(dim=(0,2,3,4), keepdim=True)
-         video_count += torch.ones_like(batch.video).sum(dim=(0,2,3,4), keepdim=True)
-         audio_sum   += batch.audio.sum(dim=(0,2), keepdim=True) 
-         audio_count += torch.ones_like(batch.audio).sum(dim=(0,2), keepdim=True)
-    video_mean = video_sum/video_count
-    audio_mean = audio_sum/audio_count
-
-    # STD pass
-    video_sse = torch.zeros(1,3,1,1,1).float()
-    audio_sse = torch.zeros(1,1,1).float()
+def get_stats(loader, device=None):
+    """Compute means and standard deviations over data points from `loader`,
+    reducing on `device` (the GPU, if there is one, by default)."""
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    # Single pass: per-batch moments are merged with Chan et al.'s parallel update.
+    # Running moments are merged in float64; per-batch moments stay float32.
+    video_n    = torch.zeros(1,3,1,1,1, device=device).double()
+    video_mean = torch.zeros(1,3,1,1,1, device=device).double()
+    video_m2   = torch.zeros(1,3,1,1,1, device=device).double()
+    audio_n    = torch.zeros(1,1,1, device=device).double()
+    audio_mean = torch.zeros(1,1,1, device=device).double()
+    audio_m2   = torch.zeros(1,1,1, device=device).double()
     for batch in loader:
-        video_sse += ((batch.video - video_mean)**2).sum(dim=(0,2,3,4), keepdim=True)
-        audio_sse += ((batch.audio - audio_mean)**2).sum(dim=(0,2), keepdim=True)
-    return Stats(video_mean = video_mean.squeeze(),
-                 video_std  = ((video_sse/video_count) **0.5).squeeze(),
-                 audio_mean = audio_mean.squeeze(),
-                 audio_std  = ((audio_sse/audio_count) **0.5).squeeze())
+        # Stats are kept on the [0, 1] scale regardless of the video dtype.
+        video = batch.video.to(device, non_blocking=True).to(torch.float32)
+        if batch.video.dtype == torch.uint8:
+            video.div_(255)
+        video_n, video_mean, video_m2 = update_moments(video_n, video_mean, video_m2,
+                                                       video, dim=(0,2,3,4))
+        audio_n, audio_mean, audio_m2 = update_moments(audio_n, audio_mean, audio_m2,
+                                                       batch.audio.to(device, non_blocking=True),
+                                                       dim=(0,2))
+    return Stats(video_mean = video_mean.squeeze().float().cpu(),
+                 video_std  = ((video_m2/video_n) **0.5).squeeze().float().cpu(),
+                 audio_mean = audio_mean.squeeze().float().cpu(),
+                 audio_std  = ((audio_m2/audio_n) **0.5).squeeze().float().cpu())
+
+def update_moments(n, mean, m2, x, dim):
+    """Merge count, mean and sum of squared deviations of `x` along `dim`
+    into the running `n`, `mean` and `m2`."""
+    batch_n    = math.prod(x.shape[d] for d in dim)
+    batch_mean = x.sum(dim=dim, keepdim=True) / batch_n
+    batch_m2   = ((x - batch_mean)**2).sum(dim=dim, keepdim=True)
+    delta = batch_mean.to(mean.dtype) - mean
+    total = n + batch_n
+    mean = mean + delta * batch_n / total
+    m2   = m2 + batch_m2.to(m2.dtype) + delta**2 * n * batch_n / total
+    return total, mean, m2
 
-def worker_init_fn(worker_id):
-    raise NotImplemented
-
-    
 class PigData(pl.LightningDataModule):
 
     def __init__(self, config):
@@ -369,7 +640,7 @@ class PigData(pl.LightningDataModule):
                                   **{k:v for k,v in self.config['train'].items()
                                      if k not in self.loader_args})
             logging.info("Saving stats")
-            stats = get_stats(DataLoader(train, collate_fn=collate, batch_size=32))
+            stats = get_stats(DataLoader(train, collate_fn=collate, batch_size=32, pin_memory=True))
             torch.save(stats, "data/out/stats.pt")
 
     def setup(self, **kwargs):
@@ -414,22 +685,28 @@ class PigData(pl.LightningDataModule):
             jitter=None)
         
         
+    def loader_kwargs(self):
+        """Worker and host memory settings shared by the training and validation loaders."""
+        kwargs = dict(num_workers=self.config['num_workers'], pin_memory=True)
+        if self.config['num_workers'] > 0:
+            kwargs.update(persistent_workers=True, prefetch_factor=4)
+        return kwargs
+        
     def train_dataloader(self):
-        return DataLoader(self.train, collate_fn=collate, num_workers=self.config['num_workers'],
+        return DataLoader(self.train, collate_fn=collate, **self.loader_kwargs(),
                           batch_size=self.config['train']['batch_size'],
                           shuffle=self.config['train']['shuffle'])
 
     def val_dataloader(self):
         
-        dia = DataLoader(self.val_dia, collate_fn=collate, num_workers=self.config['num_workers'],
+        dia = DataLoader(self.val_dia, collate_fn=collate, **self.loader_kwargs(),
                           batch_size=self.config['val']['batch_size'])
-        narr = DataLoader(self.val_narr, collate_fn=collate,
-                               num_workers=self.config['num_workers'],
+        narr = DataLoader(self.val_narr, collate_fn=collate, **self.loader_kwargs(),
                           batch_size=self.config['val']['batch_size'])
         key = lambda x: x.audio_duration
-        dia3 = grouped_loader(self.val_dia3,   key, collate,
+        dia3 = grouped_loader(self.val_dia3,   key, collate, **self.loader_kwargs(),
                               batch_size=self.config['val']['batch_size'])
-        narr3 = grouped_loader(self.val_narr3, key, collate,
+        narr3 = grouped_loader(self.val_narr3, key, collate, **self.loader_kwargs(),
                               batch_size=self.config['val']['batch_size'])
         
         return [ dia, narr, dia3, narr3 ]
@@ -1,9 +1,13 @@
 import argparse
+import contextlib
 
 import torch
 import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pig.models import PeppaPig
 import pig.data
+import pig.util
 import pytorch_lightning as pl
 import logging
 from torch.utils.data import DataLoader
@@ -13,12 +17,12 @@ import numpy as np
 import torch
 import random
 import yaml
-from copy import deepcopy
 
 random.seed(666)
 torch.manual_seed(666)
 
 BATCH_SIZE=8
+NUM_WORKERS=min(8, os.cpu_count())
 
 def data_statistics():
     rows = []
@@ -30,7 +34,7 @@ def data_statistics():
                     split=[split],
                     fragment_type=fragment_type,
                     duration=2.3)
-                duration = np.array([clip.duration for clip in ds._raw_clips() ])
+                duration = ds.durations()
                 rows.append({'Split': split, 'Type': fragment_type, 
                              'Size (h)': duration.sum() / 60 / 60,
                              '# Clips': len(duration)})
@@ -40,12 +44,10 @@ def data_statistics():
     
 
 def load_best_model(dirname, higher_better=True):
-    info = []
-    for path in glob.glob(f"{dirname}/checkpoints/*.ckpt"):
-       cp = torch.load(path, map_location='cpu')
-       item = cp['callbacks'][pl.callbacks.model_checkpoint.ModelCheckpoint]
-       if item['best_model_score'] is not None:
-           info.append(item)
+    with ThreadPoolExecutor(NUM_WORKERS) as pool:
+        callbacks = pool.map(pig.util.checkpoint_callbacks, glob.glob(f"{dirname}/checkpoints/*.ckpt"))
+        items = [ cb[pl.callbacks.model_checkpoint.ModelCheckpoint] for cb in callbacks ]
+    info = [ item for item in items if item['best_model_score'] is not None ]
     best = sorted(info, key=lambda x: x['best_model_score'], reverse=higher_better)[0]
     logging.info(f"Best {best['monitor']}: {best['best_model_score']} at {best['best_model_path']}")
     local_model_path = best['best_model_path'].split("/peppa/")[1]
@@ -53,15 +55,22 @@ def load_best_model(dirname, higher_better=True):
     return net, best['best_model_path']
 
 def score_means(data):
+    # All rows are reduced at once, along the sample dimension.
+    triplet_acc   = torch.stack([ item['triplet_acc'] for item in data ])
+    recall_fixed  = torch.stack([ item['recall_at_10_fixed'] for item in data ]).mean(dim=2)
+    recall_jitter = torch.stack([ item['recall_at_10_jitter'] for item in data ]).mean(dim=2)
+    means = dict(triplet_acc_std=triplet_acc.std(dim=1).tolist(),
+                 triplet_acc=triplet_acc.mean(dim=1).tolist(),
+                 recall_at_10_fixed_std=recall_fixed.std(dim=1).tolist(),
+                 recall_at_10_fixed=recall_fixed.mean(dim=1).tolist(),
+                 recall_at_10_jitter_std=recall_jitter.std(dim=1).tolist(),
+                 recall_at_10_jitter=recall_jitter.mean(dim=1).tolist())
     rows = []
-    for item in data:
-        row = deepcopy(item)
-        row['triplet_acc_std'] = row['triplet_acc'].std().item()
-        row['triplet_acc'] = row['triplet_acc'].mean().item()
-        row['recall_at_10_fixed_std'] = row['recall_at_10_fixed'].mean(dim=1).std().item()
-        row['recall_at_10_fixed'] = row['recall_at_10_fixed'].mean(dim=1).mean().item()
-        row['recall_at_10_jitter_std'] = row['recall_at_10_jitter'].mean(dim=1).std().item()
-        row['recall_at_10_jitter'] = row['recall_at_10_jitter'].mean(dim=1).mean().item()
+    for i, item in enumerate(data):
+        # The score tensors are replaced by their means, so they are not copied.
+        row = {k: v for k, v in item.items() if not torch.is_tensor(v)}
+        for key, values in means.items():
+            row[key] = values[i]
         rows.append(row)
     return pd.DataFrame.from_records(rows)
 
@@ -75,11 +84,15 @@ def full_score(model, gpus, split=['val']):
         types = ['dialog', 'narration']
     else:
         raise NotImplementedError
+    # Scrambling only changes the video, so audio embeddings are encoded once
+    # per dataset and reused for the scrambled condition.
+    audio_cache = {}
     for fragment_type in types:
         
         for scrambled_video in [False, True]:
             logging.info(f"Evaluating: {fragment_type}, scramble={scrambled_video} triplet")
-            acc = triplet_score(fragment_type, model, trainer, scrambled_video=scrambled_video, split=split)
+            acc = triplet_score(fragment_type, model, trainer, scrambled_video=scrambled_video, split=split,
+                                audio_cache=audio_cache)
             logging.info(f"Evaluating: {fragment_type}, scramble={scrambled_video} recall_fixed")
             rec_fixed = resampled_retrieval_score(fragment_type,
                                                   model,
@@ -89,7 +102,8 @@ def full_score(model, gpus, split=['val']):
                                                   jitter_sd=None,
                                                   scrambled_video=scrambled_video,
                                                   split=split,
-                                                  one_to_n=True)
+                                                  one_to_n=True,
+                                                  audio_cache=audio_cache)
             logging.info(f"Evaluating: {fragment_type}, scramble={scrambled_video} recall_jitter")
             rec_jitter = resampled_retrieval_score(fragment_type,
                                                    model,
@@ -99,7 +113,8 @@ def full_score(model, gpus, split=['val']):
                                                    jitter_sd=0.5,
                                                    scrambled_video=scrambled_video,
                                                    split=split,
-                                                   one_to_n=True)
+                                                   one_to_n=True,
+                                                   audio_cache=audio_cache)
             data.append(dict(fragment_type=fragment_type,
                              scrambled_video=scrambled_video,
                              triplet_acc=acc,
@@ -109,6 +124,29 @@ def full_score(model, gpus, split=['val']):
                              recall_at_10_jitter=rec_jitter[:,10,:]))
     return data
         
+def predict_embeddings(model, trainer, loader, audio=None):
+    """Video and audio embeddings of all batches in `loader`, each filled
+    into a single preallocated tensor. If the `audio` embeddings are already
+    known, `loader` only needs to provide video and they are passed through."""
+    with torch.inference_mode():
+        batches = trainer.predict(model, loader)
+    V = pig.util.fill_rows([ batch.video for batch in batches ])
+    if audio is None:
+        audio = pig.util.fill_rows([ batch.audio for batch in batches ])
+    return V, audio
+
+@contextlib.contextmanager
+def cudnn_benchmark(enabled=True):
+    """Lets cuDNN autotune convolutions if `enabled`. Every new input shape
+    is tuned again, so this only pays off when all clips have the same
+    fixed duration, i.e. without jitter."""
+    previous = torch.backends.cudnn.benchmark
+    torch.backends.cudnn.benchmark = enabled or previous
+    try:
+        yield
+    finally:
+        torch.backends.cudnn.benchmark = previous
+
 def retrieval_score(fragment_type, model, trainer, duration=2.3, jitter=False, jitter_sd=None, batch_size=BATCH_SIZE, split=['val']):
         base_ds = pig.data.PeppaPigDataset(
             target_size=model.config["data"]["target_size"],
@@ -119,13 +157,13 @@ def retrieval_score(fragment_type, model, trainer, duration=2.3, jitter=False, j
             jitter_sd=jitter_sd
             )
         key = lambda x: x.audio_duration
-        loader = pig.data.grouped_loader(base_ds, key, pig.data.collate, batch_size=batch_size)
-        V, A = zip(* [(batch.video, batch.audio) for batch
-                  in trainer.predict(model, loader) ])
-        V = torch.cat(V, dim=0)
-        A = torch.cat(A, dim=0)
-        correct = torch.eye(V.shape[0], device=A.device)
-        rec10 = pig.metrics.recall_at_n(V, A, correct=correct, n=10).mean().item()
+        loader = pig.data.grouped_loader(base_ds, key, pig.data.collate, batch_size=batch_size,
+                                         pin_memory=True, prefetch=True,
+                                         num_workers=NUM_WORKERS, prefetch_factor=4)
+        with cudnn_benchmark(enabled=not jitter):
+            V, A = predict_embeddings(model, trainer, loader)
+        correct_idx = torch.arange(V.shape[0], device=A.device)
+        rec10 = pig.metrics.recall_at_n(V, A, correct_idx=correct_idx, n=10).mean().item()
         return rec10
 
 def resampled_retrieval_score(fragment_type,
@@ -137,7 +175,8 @@ def resampled_retrieval_score(fragment_type,
                               batch_size=BATCH_SIZE,
                               scrambled_video=False,
                               split=['val'],
-                              one_to_n=False
+                              one_to_n=False,
+                              audio_cache=None
                               ):
         base_ds = pig.data.PeppaPigDataset(
             target_size=model.config["data"]["target_size"],
@@ -150,12 +189,17 @@ def resampled_retrieval_score(fragment_type,
             jitter_sd=jitter_sd,
             scrambled_video=scrambled_video,
             )
+        cache_key = (fragment_type, tuple(split), duration, jitter, jitter_sd)
+        audio = None if audio_cache is None else audio_cache.get(cache_key)
         key = lambda x: x.audio_duration
-        loader = pig.data.grouped_loader(base_ds, key, pig.data.collate, batch_size=batch_size)
-        V, A = zip(* [(batch.video, batch.audio) for batch
-                  in trainer.predict(model, loader) ])
-        V = torch.cat(V, dim=0)
-        A = torch.cat(A, dim=0)
+        collate = pig.data.collate if audio is None else pig.data.collate_video
+        loader = pig.data.grouped_loader(base_ds, key, collate, batch_size=batch_size,
+                                         pin_memory=True, prefetch=True,
+                                         num_workers=NUM_WORKERS, prefetch_factor=4)
+        with cudnn_benchmark(enabled=not jitter):
+            V, A = predict_embeddings(model, trainer, loader, audio=audio)
+        if audio_cache is not None:
+            audio_cache[cache_key] = A
         rec = pig.metrics.resampled_recall_at_1_to_n(V, A, size=100, n_samples=500, N=10)
         if one_to_n:
             return rec
@@ -163,30 +207,40 @@ def resampled_retrieval_score(fragment_type,
             return rec[:,10,:]
 
 
-def triplet_score(fragment_type, model, trainer, batch_size=BATCH_SIZE, scrambled_video=False, split=['val']):
+def triplet_score(fragment_type, model, trainer, batch_size=BATCH_SIZE, scrambled_video=False, split=['val'],
+                  audio_cache=None):
     from pig.triplet import TripletScorer
     scorer = TripletScorer(fragment_type=fragment_type, split=split, target_size=model.config["data"]["target_size"],
                            audio_sample_rate=model.config["data"].get('audio_sample_rate',
                                                                       pig.data.DEFAULT_SAMPLE_RATE),
                            scrambled_video=scrambled_video)
-    acc = scorer.evaluate(model, trainer=trainer, n_samples=500, batch_size=batch_size)
+    cache_key = (fragment_type, tuple(split), None, False, None)
+    audio = None if audio_cache is None else audio_cache.get(cache_key)
+    acc = scorer.evaluate(model, trainer=trainer, n_samples=500, batch_size=batch_size, audio=audio)
+    if audio_cache is not None:
+        audio_cache[cache_key] = scorer._audio
     return acc
 
 def comparative_triplet_score(fragment_type, models, trainer, batch_size=BATCH_SIZE,
                               scrambled_video=False, split=['val']):
     from pig.triplet import TripletScorer, comparative_score_triplets
-    scorers = [ TripletScorer(fragment_type=fragment_type, split=split,
-                            target_size=model.config["data"]["target_size"],
-                            audio_sample_rate=model.config["data"].get('audio_sample_rate',
-                                                                pig.data.DEFAULT_SAMPLE_RATE),
-                            scrambled_video=scrambled_video)
-                for model in models ]
-    for i in range(len(models)):
-        scorers[i]._encode(models[i], trainer, batch_size)
-    result = comparative_score_triplets([ scorer._video for scorer in scorers],
-                                        [ scorer._audio for scorer in scorers],
-                                        scorers[0]._duration,
-                                        n_samples=500)
+    # Models reading the same clips share one scorer and its dataset.
+    scorers = {}
+    video, audio = [], []
+    for model in models:
+        target_size = model.config["data"]["target_size"]
+        audio_sample_rate = model.config["data"].get('audio_sample_rate', pig.data.DEFAULT_SAMPLE_RATE)
+        data_key = (tuple(target_size), audio_sample_rate)
+        if data_key not in scorers:
+            scorers[data_key] = TripletScorer(fragment_type=fragment_type, split=split,
+                                              target_size=target_size,
+                                              audio_sample_rate=audio_sample_rate,
+                                              scrambled_video=scrambled_video)
+        scorer = scorers[data_key]
+        scorer._encode(model, trainer, batch_size)
+        video.append(scorer._video)
+        audio.append(scorer._audio)
+    result = comparative_score_triplets(video, audio, scorer._duration, n_samples=500)
     return result
     
 def pretraining(row):
@@ -275,9 +329,9 @@ def test_run(gpu=0):
 def test_table():
     data = torch.load(f"results/full_test_scores.pt")
     rows = [ datum for datum in data if not datum['scrambled_video'] ]
-    recall_fixed  = torch.cat([ row['recall_at_10_fixed'].mean(dim=1) for row in rows ])
-    recall_jitter = torch.cat([ row['recall_at_10_jitter'].mean(dim=1) for row in rows ])
-    triplet_acc   = torch.cat([ row['triplet_acc']  for row in rows ])
+    recall_fixed  = torch.stack([ row['recall_at_10_fixed'] for row in rows ]).mean(dim=2).flatten()
+    recall_jitter = torch.stack([ row['recall_at_10_jitter'] for row in rows ]).mean(dim=2).flatten()
+    triplet_acc   = torch.stack([ row['triplet_acc']  for row in rows ]).flatten()
     table = pd.DataFrame.from_records(
         [{'R@10 (fixed)':
           f"{recall_fixed.mean().item():0.2f} ± {recall_fixed.std().item():0.2f}",
@@ -184,8 +184,8 @@ def embed_utterances(version, fragment_type='dialog', grouped=True, embedder='st
         else:
             loader = audioclip_loader(utt.audio for utt in data.utterances(read_audio=True))
 
-        emb_1, emb_2 = zip(*[ (net_1.encode_audio(batch.to(net_1.device)).squeeze(dim=1),
-                               net_2.encode_audio(batch.to(net_2.device)).squeeze(dim=1))
+        emb_1, emb_2 = zip(*[ (net_1.encode_audio(batch.to(net_1.device, non_blocking=True)).squeeze(dim=1),
+                               net_2.encode_audio(batch.to(net_2.device, non_blocking=True)).squeeze(dim=1))
                               for batch in loader ])
     emb_1 = torch.cat(emb_1)
     emb_2 = torch.cat(emb_2)
@@ -220,8 +220,8 @@ def pairwise(version, fragment_type='dialog', multiword=False):
     net_1.eval(); net_1.cuda()
     with torch.no_grad():
         loader = audioclip_loader(utt.audio for utt in data.utterances(read_audio=True))
-        emb_1, emb_2 = zip(*[ (net_1.encode_audio(batch.to(net_1.device)).squeeze(dim=1),
-                               net_2.encode_audio(batch.to(net_1.device)).squeeze(dim=1))
+        emb_1, emb_2 = zip(*[ (net_1.encode_audio(batch.to(net_1.device, non_blocking=True)).squeeze(dim=1),
+                               net_2.encode_audio(batch.to(net_1.device, non_blocking=True)).squeeze(dim=1))
                               for batch in loader ])
     emb_1 = torch.cat(emb_1)
     emb_2 = torch.cat(emb_2)
@@ -403,7 +403,7 @@ def vanilla_rsa(embedder, labels=['speaker']):
             X, Y = prepare_probe(embedder, feature, label)
             X = torch.tensor(X)
             X_sim = cosine_matrix(X, X)
-            Y_sim = torch.tensor([[y1 == y2 for y1 in Y] for y2 in Y]).float()
+            Y_sim = torch.from_numpy(Y[:, None] == Y[None, :]).float()
             r = pearson_r(triu(X_sim), triu(Y_sim)).item()
             records.append(dict(label=label, feature=feature, r=r))
     return pd.DataFrame.from_records(records)
@@ -441,14 +441,14 @@ class Embedder:
         config_0 = deepcopy(net_2.config)
         config_0['audio']['pretrained'] = False
         net_0 = PeppaPig(config_0).eval().cuda()
-        embed_untrained = lambda batch: net_0.encode_audio(batch.to(net_0.device)).squeeze(dim=1)
-        embed_trained = lambda batch: net_2.encode_audio(batch.to(net_2.device)).squeeze(dim=1)
-        embed_project     = lambda batch: net_1.encode_audio(batch.to(net_1.device)).squeeze(dim=1)
+        embed_untrained = lambda batch: net_0.encode_audio(batch.to(net_0.device, non_blocking=True)).squeeze(dim=1)
+        embed_trained = lambda batch: net_2.encode_audio(batch.to(net_2.device, non_blocking=True)).squeeze(dim=1)
+        embed_project     = lambda batch: net_1.encode_audio(batch.to(net_1.device, non_blocking=True)).squeeze(dim=1)
         def embed_wav2vec(batch):
-            feat, _ = net_2.audio_encoder.audio.extract_features(batch.to(net_2.device).squeeze(dim=1))
+            feat, _ = net_2.audio_encoder.audio.extract_features(batch.to(net_2.device, non_blocking=True).squeeze(dim=1))
             return feat.mean(dim=1)
         def embed_conv(batch):
-            feat, _ = net_2.audio_encoder.audio.feature_extractor(batch.to(net_2.device).squeeze(dim=1),
+            feat, _ = net_2.audio_encoder.audio.feature_extractor(batch.to(net_2.device, non_blocking=True).squeeze(dim=1),
                                                                   None)
             return feat.mean(dim=1)
         for fragment_type in self.embedding:
@@ -484,7 +484,7 @@ def feat_speak(fragment_type, embed=None, version=None):
     if embed is None:
         net_2, net_path = evaluation.load_best_model(checkpoint_path(version))
         net_2.eval(); net_2.cuda()
-        embed = lambda batch: net_2.encode_audio(batch.to(net_2.device)).squeeze(dim=1)
+        embed = lambda batch: net_2.encode_audio(batch.to(net_2.device, non_blocking=True)).squeeze(dim=1)
     loader = audioclip_loader(utt.audio for utt in data.utterances(read_audio=True))
     with torch.no_grad():
         emb_2 = torch.cat([embed(batch) for batch in loader ])
@@ -4,40 +4,20 @@ import torch.nn.functional as F
 import logging
 
 
-def recall_at_n(candidates, references, correct, n=1):
+def target_rank(candidates, references, correct_idx):
+    "Rank of the target candidate `correct_idx[j]` among all candidates, by distance to reference j."
     distances = 1-cosine_matrix(references, candidates)
-    recall = []
-    for j, row in enumerate(distances):
-        # ids ordered by distance
-        ranked = row.argsort()
-        # top N ids
-        topn = ranked[:n]
-        # target ids
-        target = torch.nonzero(correct[j])[:,0]
-        # overlap between top N and target
-        overlap = (topn.unsqueeze(dim=0) == target.unsqueeze(dim=1)).sum().item()
-        # proportion of correctly retrieved to target
-        recall.append(overlap/len(target))
-    return torch.tensor(recall)
+    target = distances.gather(1, correct_idx.unsqueeze(dim=1))
+    return (distances < target).sum(dim=1)
 
-def recall_at_1_to_n(candidates, references, correct, N=1):
-    distances = 1-cosine_matrix(references, candidates)
-    recall = [ [] for n in range(0, N+1) ]
+def recall_at_n(candidates, references, correct_idx, n=1):
+    return (target_rank(candidates, references, correct_idx) < n).float()
+
+def recall_at_1_to_n(candidates, references, correct_idx, N=1):
+    rank = target_rank(candidates, references, correct_idx)
     # Recall at 0 is always zero
-    recall[0] = [ 0 for row in distances ]
-    for j, row in enumerate(distances):
-        # ids ordered by distance
-        ranked = row.argsort()
-        # target ids
-        target = torch.nonzero(correct[j])[:,0]
-        for n in range(1, N+1):
-            # top N ids
-            topn = ranked[:n]
-            # overlap between top N and target
-            overlap = (topn.unsqueeze(dim=0) == target.unsqueeze(dim=1)).sum().item()
-            # proportion of correctly retrieved to target
-            recall[n].append(overlap/len(target))
-    return torch.tensor(recall)
+    n = torch.arange(0, N+1, device=rank.device).unsqueeze(dim=1)
+    return (rank.unsqueeze(dim=0) < n).float()
 
 def batch_triplet_accuracy(batch):
     return triplet_accuracy(batch.anchor, batch.positive, batch.negative)
@@ -59,9 +39,9 @@ def resampled_recall(candidates, references, size=100, n_samples=100, n=1):
         ix = sample_indices(candidates, size)
         X = candidates[ix]
         Y = references[ix]
-        Z = torch.eye(X.shape[0], device=X.device)
+        Z = torch.arange(X.shape[0], device=X.device)
         result.append(recall_at_n(X, Y, Z, n=n))
-    return torch.stack(result)
+    return torch.stack(result).cpu()
 
 
 def resampled_recall_at_1_to_n(candidates, references, size=100, n_samples=100, N=1):
@@ -72,9 +52,9 @@ def resampled_recall_at_1_to_n(candidates, references, size=100, n_samples=100,
         ix = sample_indices(candidates, size)
         X = candidates[ix]
         Y = references[ix]
-        Z = torch.eye(X.shape[0], device=X.device)
+        Z = torch.arange(X.shape[0], device=X.device)
         result.append(recall_at_1_to_n(X, Y, Z, N=N))
-    return torch.stack(result)
+    return torch.stack(result).cpu()
 
 def sample_indices(x, size):
     ix = torch.randperm(x.size(0))[:size]
@@ -1,8 +1,9 @@
 import os
+import copy
+import functools
 import torch
 from torch import nn
 import torch.nn.functional as F
-from torchvision import transforms
 from torch.utils.data import DataLoader, random_split
 import pytorch_lightning as pl
 import torchvision.models.video as V
@@ -10,7 +11,6 @@ from torchvision.models import resnet18
 import torchaudio.models as A
 from torchaudio.models.wav2vec2.utils import import_fairseq_model
 import fairseq
-from torchvision.transforms import Compose
 from pig.loss import TripletLoss
 import pig.data
 import pig.triplet
@@ -21,7 +21,7 @@ import pig.metrics
 from pytorch_lightning.callbacks import ModelCheckpoint
 import pig.optimization as opt
 import pig.transforms
-from torchvision.transforms import Normalize, Compose
+from torchvision.transforms import Compose
 from pig.triplet import score_triplets
 
 from pig.targeted_triplets import TripletBatch
@@ -103,10 +103,9 @@ class Wav2VecEncoder(nn.Module):
             features, _ = self.audio(x.squeeze(dim=1))
         else:
             features, _ = self.audio.extract_features(x.squeeze(dim=1))
-        return Compose([self.audiopool,
-                        self.project,
-                        lambda x: nn.functional.normalize(x, p=2, dim=1)
-        ])(features)
+        x = self.audiopool(features)
+        x = self.project(x)
+        return nn.functional.normalize(x, p=2, dim=1)
 
         
 ## Video encoders
@@ -138,20 +137,18 @@ class R3DEncoder(nn.Module):
         else:
             raise ValueError(f"Invalid pooling {pooling}")
         self.transform = build_transform("kinetics" if self.pretrained else "peppa")
-        self.encode = Compose([self.transform,
-                               self.video.stem,
-                               self.video.layer1,
-                               self.video.layer2,
-                               self.video.layer3,
-                               self.video.layer4,
-                               self.videopool,
-                               self.project,
-                               lambda x: nn.functional.normalize(x, p=2, dim=1)
-        ])
 
         
     def forward(self, x):
-        return self.encode(x)
+        x = self.transform(x)
+        x = self.video.stem(x)
+        x = self.video.layer1(x)
+        x = self.video.layer2(x)
+        x = self.video.layer3(x)
+        x = self.video.layer4(x)
+        x = self.videopool(x)
+        x = self.project(x)
+        return nn.functional.normalize(x, p=2, dim=1)
 
 class ImageEncoder(nn.Module):
 
@@ -242,16 +239,27 @@ class PeppaPig(pl.LightningModule):
             return pig.triplet.TripletBatch(anchor=a, positive=p, negative=n)
         else:
             V = self.encode_video(batch.video)
-            A = self.encode_audio(batch.audio)
+            A = self.encode_audio(batch.audio) if batch.audio is not None else None
             return pig.data.ClipBatch(video=V, audio=A,
                                       video_duration=batch.video_duration,
                                       audio_duration=batch.audio_duration)
         
+    def _autocast(self):
+        # Inference runs in half precision even when the trainer does not
+        # use precision=16; training keeps the trainer's setting.
+        return torch.cuda.amp.autocast(enabled=self.device.type == 'cuda' and not self.training)
+
+    @torch.inference_mode()
+    def predict_step(self, batch, batch_idx, dataloader_idx=None):
+        return self(batch)
+
     def encode_video(self, x):
-        return self.video_encoder(x)
+        with self._autocast():
+            return self.video_encoder(x)
     
     def encode_audio(self, x):
-        return self.audio_encoder(x)
+        with self._autocast():
+            return self.audio_encoder(x)
     
     def training_step(self, batch, batch_idx):
         # training_step defined the train loop.
@@ -291,29 +299,19 @@ class PeppaPig(pl.LightningModule):
     def validation_epoch_end(self, outputs):
         # rec10
         out_main, out_narr, out_dia3, out_narr3 = outputs
-        V, A = zip(*out_main)
-        V = torch.cat(V, dim=0)
-        A = torch.cat(A, dim=0)
+        V, A = map(pig.util.fill_rows, zip(*out_main))
         rec_fixed = pig.metrics.resampled_recall(V, A, size=100, n_samples=500, n=10)
         self.log("val_rec_fixed", rec_fixed, prog_bar=True)
 
-        V, A = zip(*out_narr)
-        V = torch.cat(V, dim=0)
-        A = torch.cat(A, dim=0)
+        V, A = map(pig.util.fill_rows, zip(*out_narr))
         rec_narr_fixed = pig.metrics.resampled_recall(V, A, size=100, n_samples=500, n=10)
         self.log("valnarr_rec_fixed", rec_narr_fixed, prog_bar=True)
 
         # triplet
-        V, A, D = zip(*out_dia3)
-        V = torch.cat(V, dim=0)
-        A = torch.cat(A, dim=0)
-        D = torch.cat(D, dim=0)
+        V, A, D = map(pig.util.fill_rows, zip(*out_dia3))
         tri_d = score_triplets(V, A, D, n_samples=500)
         self.log("val_triplet", tri_d, prog_bar=True)
-        V, A, D = zip(*out_narr3)
-        V = torch.cat(V, dim=0)
-        A = torch.cat(A, dim=0)
-        D = torch.cat(D, dim=0)
+        V, A, D = map(pig.util.fill_rows, zip(*out_narr3))
         tri_n = score_triplets(V, A, D, n_samples=500)
         self.log("valnarr_triplet", tri_n, prog_bar=True)
         
@@ -324,19 +322,32 @@ class PeppaPig(pl.LightningModule):
         optimizer = opt.BertAdam(self.parameters(), **self.config['optimizer'])
         return optimizer
 
+def quantized_for_cpu(model):
+    """Copy of `model` for CPU inference, with the Linear layers of its
+    wav2vec encoder dynamically quantized to int8 if that encoder was kept
+    fully frozen in training. Other models are returned unchanged."""
+    audio = model.config['audio']
+    if audio.get('freeze_feature_extractor') and audio.get('freeze_encoder_layers') == 12:
+        model = copy.deepcopy(model).cpu()
+        torch.quantization.quantize_dynamic(model.audio_encoder.audio, {nn.Linear},
+                                            dtype=torch.qint8, inplace=True)
+    return model
+
+@functools.lru_cache(maxsize=None)
+def load_stats(path):
+    """Loads a `pig.data.Stats` file once per process."""
+    return torch.load(path)
+
 def build_transform(normalization):
     if normalization == 'peppa':
-        stats = torch.load("data/out/stats.pt")
-        normalize = Normalize(mean=stats.video_mean, std=stats.video_std, inplace=True) 
+        stats = load_stats("data/out/stats.pt")
+        normalize = pig.transforms.Uint8ToNorm(mean=stats.video_mean, std=stats.video_std)
     elif normalization == 'kinetics':
-        stats = torch.load("data/out/kinetics-stats.pt")
-        normalize = Normalize(mean=stats.video_mean, std=stats.video_std, inplace=True)
+        stats = load_stats("data/out/kinetics-stats.pt")
+        normalize = pig.transforms.Uint8ToNorm(mean=stats.video_mean, std=stats.video_std)
     elif normalization == "imagenet":
-        normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                                         std=[0.229, 0.224, 0.225])
+        normalize = pig.transforms.Uint8ToNorm(mean=[0.485, 0.456, 0.406],
+                                               std=[0.229, 0.224, 0.225])
     else:
         raise ValueError(f"Unsupported normalization type {self.normalization}")
-    return Compose([ pig.transforms.SwapCT(),
-                     normalize, 
-                     pig.transforms.SwapCT()
-    ])
+    return normalize
@@ -57,19 +57,25 @@ def extract_from_episode(annotation, video, target_size):
         json.dump(narrations_meta[i], open(f"data/out/{width}x{height}/narration/{annotation['id']}/{i}.json", 'w'))
         
 def lines(clip, metadata):
-    start = pd.Timedelta(metadata['subtitles'][0]['begin'])
     logging.info(f"Extracting lines from {clip.filename}, {clip.duration} seconds")
+    for begin, end in line_times(clip.duration, metadata, filename=clip.filename):
+        sub = clip.subclip(begin, end)
+        sub.offset = begin
+        yield sub
+
+def line_times(total, metadata, filename=None):
+    """Yields (begin, end) of the subtitle lines in `metadata`, relative to
+    the first line and cut off at `total` seconds."""
+    start = pd.Timedelta(metadata['subtitles'][0]['begin'])
     logging.info(f"Time offset {start}")
     for line in metadata['subtitles']:
         #logging.info(f"Line: {line}")
         begin = (pd.Timedelta(line['begin'])-start).seconds
-        end = min(clip.duration, (pd.Timedelta(line['end'])-start).seconds)
-        if begin < clip.duration:
-            sub = clip.subclip(begin, end)
-            sub.offset = begin
-            yield sub
+        end = min(total, (pd.Timedelta(line['end'])-start).seconds)
+        if begin < total:
+            yield begin, end
         else:
-            logging.warning(f"Line {line} starts past end of clip {clip.filename}")
+            logging.warning(f"Line {line} starts past end of clip {filename}")
             
 def extract_realines(target_size=(180, 100)):
     from pig.triplet import grouped
@@ -93,33 +99,45 @@ def segment(clip, duration=3.2, jitter=False, jitter_sd=1.0):
     if jitter:
         yield from segment_jitter(clip, duration=duration, sd=jitter_sd)
     else:
-        start = 0
-        end = start + duration
-        while end <= clip.duration:
+        for start, end in segment_times(clip.duration, duration=duration):
             sub = clip.subclip(start, end)
             sub.offset = start
-            start = end
-            end   = end + duration
             yield sub
 
+def segment_times(total, duration=3.2):
+    """Yields (start, end) of consecutive non-overlapping segments of
+    `duration` seconds which fit within `total` seconds."""
+    start = 0
+    end = start + duration
+    while end <= total:
+        yield start, end
+        start = end
+        end   = end + duration
+
 def segment_jitter(clip, duration=3.2, sd=1.0):
+    for start_v, end_v, start_a, end_a in jitter_times(clip.duration, duration=duration, sd=sd):
+        sub_a = clip.audio.subclip(start_a, end_a)
+        sub = clip.subclip(start_v, end_v)
+        sub.audio = sub_a
+        yield sub
+
+def jitter_times(total, duration=3.2, sd=1.0):
+    """Yields (start_v, end_v, start_a, end_a) of video and audio windows of
+    jittered size, centered on consecutive segments of `duration` seconds."""
     if sd is None:
         sd = 1.0
     logging.info(f"Jittering around duration {duration}") 
     start = 0
     end = start + duration
-    while end <= clip.duration:
+    while end <= total:
         size_a = min(6.0, max(0.05, duration + random.normalvariate(0.0, sd)))
         size_v = min(6.0, max(0.05, duration + random.normalvariate(0.0, sd)))
         mid = end - (end - start) / 2
         start_a = max(0, mid - (size_a/2))
-        end_a   = min(clip.duration, mid + (size_a/2))
+        end_a   = min(total, mid + (size_a/2))
         start_v = max(0, mid - (size_v/2))
-        end_v   = min(clip.duration, mid + (size_v/2))
-        sub_a = clip.audio.subclip(start_a, end_a)
-        sub = clip.subclip(start_v, end_v)
-        sub.audio = sub_a
-        yield sub
+        end_v   = min(total, mid + (size_v/2))
+        yield start_v, end_v, start_a, end_a
         start = end
         end = end + duration
 
@@ -2,6 +2,7 @@ import glob
 import json
 import logging
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
 import moviepy.editor as m
@@ -31,6 +32,12 @@ class TripletBatch:
     positive: torch.tensor
     negative: torch.tensor
 
+    def pin_memory(self):
+        """Called by DataLoader when `pin_memory=True`."""
+        return TripletBatch(anchor=self.anchor.pin_memory(),
+                            positive=self.positive.pin_memory(),
+                            negative=self.negative.pin_memory())
+
 
 class PeppaTargetedTripletCachedDataset(Dataset):
 
@@ -108,12 +115,16 @@ class PeppaTargetedTripletDataset(Dataset):
 
     def __getitem__(self, idx):
         target_info, distractor_info = self._sample[idx]
-        with m.VideoFileClip(target_info['path']) as target:
-            with m.VideoFileClip(distractor_info['path']) as distractor:
-                positive = featurize(target, self.audio_sample_rate)
-                negative = featurize(distractor, self.audio_sample_rate)
-                return Triplet(anchor=positive.audio, positive=positive.video, negative=negative.video,
-                               audio_duration=target.audio.duration, video_duration=target.duration)
+        # Each clip is decoded by its own ffmpeg process, so the two reads overlap.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            positive, negative = executor.map(self._featurize_file,
+                                              [target_info['path'], distractor_info['path']])
+        return Triplet(anchor=positive.audio, positive=positive.video, negative=negative.video,
+                       audio_duration=positive.audio_duration, video_duration=positive.video_duration)
+
+    def _featurize_file(self, path):
+        with m.VideoFileClip(path) as clip:
+            return featurize(clip, self.audio_sample_rate)
 
     def __len__(self):
         return len(self._sample)
@@ -160,7 +171,6 @@ class PeppaTargetedTripletDataset(Dataset):
 
 
 def collate_triplets(data):
-    anchor, pos, neg = zip(*[(x.anchor, x.positive, x.negative) for x in data])
-    return TripletBatch(anchor=pad_audio_batch(anchor),
-                        positive=pad_video_batch(pos),
-                        negative=pad_video_batch(neg))
+    return TripletBatch(anchor=pad_audio_batch([x.anchor for x in data]),
+                        positive=pad_video_batch([x.positive for x in data]),
+                        negative=pad_video_batch([x.negative for x in data]))
@@ -2,7 +2,24 @@ import torch
 import torch.nn as nn
 
 
-class SwapCT(nn.Module):
+class Uint8ToNorm(nn.Module):
+    """Converts a (B, C, T, H, W) video batch to float and normalizes the
+    channels with `mean` and `std` given on the [0, 1] scale. uint8 frames
+    are taken to be in [0, 255], with the 1/255 scaling folded into the stats."""
+
+    def __init__(self, mean, std):
+        super().__init__()
+        mean = torch.as_tensor(mean, dtype=torch.float32).view(1, -1, 1, 1, 1)
+        inv_std = 1.0 / torch.as_tensor(std, dtype=torch.float32).view(1, -1, 1, 1, 1)
+        # Non-persistent, so the stats follow the model to its device
+        # without changing the checkpoint format.
+        self.register_buffer('mean', mean, persistent=False)
+        self.register_buffer('inv_std', inv_std, persistent=False)
+        self.register_buffer('mean_u8', mean * 255, persistent=False)
+        self.register_buffer('inv_std_u8', inv_std / 255, persistent=False)
 
     def forward(self, vid: torch.Tensor) -> torch.Tensor:
-        return vid.permute(0, 2, 1, 3, 4)
+        if vid.dtype == torch.uint8:
+            return vid.to(torch.float32).sub_(self.mean_u8).mul_(self.inv_std_u8)
+        else:
+            return (vid - self.mean).mul_(self.inv_std)
@@ -7,7 +7,8 @@ import pig.util as U
 from dataclasses import dataclass
 import os
 import random
-from pig.util import grouped, shuffled
+import numpy as np
+from pig.util import grouped
 import pig.data
 import glob
 import pytorch_lightning as pl
@@ -41,32 +42,35 @@ class TripletScorer:
         )
 
 
-    def _encode(self, model, trainer, batch_size):
+    def _encode(self, model, trainer, batch_size, audio=None):
+        """Encodes the dataset. If the `audio` embeddings of this dataset are
+        given, only the video is encoded."""
         key = lambda x: x.audio_duration
-        loader = pig.data.grouped_loader(self.dataset, key, pig.data.collate, batch_size=batch_size)
-        audio, video, duration =  zip(*[ (batch.audio, batch.video, batch.audio_duration) for batch
-                                         in trainer.predict(model, loader) ])
-        self._duration = torch.cat(duration)
-        self._audio = torch.cat(audio)
-        self._video = torch.cat(video)
+        collate = pig.data.collate if audio is None else pig.data.collate_video
+        loader = pig.data.grouped_loader(self.dataset, key, collate, batch_size=batch_size,
+                                         pin_memory=True, prefetch=True)
+        with torch.inference_mode():
+            batches = trainer.predict(model, loader)
+        self._duration = U.fill_rows([ batch.audio_duration for batch in batches ])
+        self._audio = U.fill_rows([ batch.audio for batch in batches ]) if audio is None else audio
+        self._video = U.fill_rows([ batch.video for batch in batches ])
  
         
     def _score(self, n_samples=100):
         return score_triplets(self._video, self._audio, self._duration, n_samples=n_samples)
     
-    def evaluate(self, model, batch_size, n_samples=100, trainer=None):
+    def evaluate(self, model, batch_size, n_samples=100, trainer=None, audio=None):
         if trainer is None:
             trainer = pl.Trainer(gpus=1, logger=False)
-        self._encode(model, trainer, batch_size)
+        self._encode(model, trainer, batch_size, audio=audio)
         return self._score(n_samples=n_samples)
 
 def comparative_score_triplets(video_set, audio_set, duration, n_samples=100):
     success = [[] for i in range(len(video_set)) ]
     length = []
+    durations = duration.cpu().numpy()
     for i in range(n_samples):
-        pos_idx, neg_idx = zip(*_triplets(range(len(duration)), lambda idx: duration[idx]))
-        pos_idx = torch.tensor(pos_idx)
-        neg_idx = torch.tensor(neg_idx)
+        pos_idx, neg_idx = map(torch.from_numpy, triplet_indices(durations))
         for i in range(len(video_set)):
             acc = triplet_accuracy(anchor=audio_set[i][pos_idx],
                                    positive=video_set[i][pos_idx],
@@ -82,15 +86,13 @@ def comparative_score_triplets(video_set, audio_set, duration, n_samples=100):
 def score_triplets(video, audio, duration, n_samples=100):
     accuracy = []
     length = []
+    durations = duration.cpu().numpy()
     for i in range(n_samples):
-        pos_idx, neg_idx = zip(*_triplets(range(len(duration)), lambda idx: duration[idx]))
-        pos_idx = torch.tensor(pos_idx)
-        neg_idx = torch.tensor(neg_idx)
+        pos_idx, neg_idx = map(torch.from_numpy, triplet_indices(durations))
         acc = triplet_accuracy(anchor=audio[pos_idx],
                                    positive=video[pos_idx],
                                    negative=video[neg_idx])
         accuracy.append(acc.mean().item())
-        success.append(success)
         length.append(duration[pos_idx])
     return {'accuracy': torch.tensor(accuracy),
             'duration': torch.cat(length) }
@@ -98,12 +100,31 @@ def score_triplets(video, audio, duration, n_samples=100):
 
 def _triplets(clips, criterion): 
     for size, items in grouped(clips, key=criterion):
-        paired = pairs(shuffled(items))
-        for p in paired:
-            target, distractor = random.sample(p, 2)
+        items = list(items)
+        random.shuffle(items)
+        for p in pairs(items):
+            # One random bit decides which member of the pair is the target.
+            target, distractor = p if random.random() < 0.5 else (p[1], p[0])
             yield (target, distractor)
 
 
+def triplet_indices(durations):
+    """Array version of `_triplets` over clip indices: returns target and
+    distractor indices, pairing clips of equal duration at random."""
+    # Seeded from `random`, so that random.seed still makes scores reproducible.
+    rng = np.random.default_rng(random.getrandbits(32))
+    perm = rng.permutation(len(durations))
+    order = perm[np.argsort(durations[perm], kind='stable')]
+    keys = durations[order]
+    start = np.r_[0, np.flatnonzero(keys[1:] != keys[:-1]) + 1]
+    size = np.diff(np.r_[start, len(keys)])
+    group = np.repeat(np.arange(len(start)), size)
+    rank = np.arange(len(keys)) - start[group]
+    first = np.flatnonzero((rank % 2 == 0) & (rank + 1 < size[group]))
+    a, b = order[first], order[first + 1]
+    swap = rng.random(len(first)) < 0.5
+    return np.where(swap, b, a), np.where(swap, a, b)
+
 def triplets(clips):
     """Generates triplets of (a, v1, v2) where a is an audio clip, v1
        matching video and v2 a distractor video, matched by duration."""
@@ -113,9 +134,6 @@ def triplets(clips):
 
 
 def pairs(xs):
-    p = []
-    for i in range(0, len(xs), 2):
-        x = xs[i:i+2]
-        if len(x) == 2:
-            p.append(x)
-    return p
+    """Splits `xs` into consecutive non-overlapping pairs, dropping a
+    trailing odd element."""
+    return list(zip(xs[0::2], xs[1::2]))
@@ -1,7 +1,9 @@
 import torch
-import torch.nn.functional as F
-from itertools import groupby
-import random
+from collections import defaultdict
+import logging
+import inspect
+import pickle
+import zipfile
 
 def identity(x):
     return x
@@ -17,28 +19,48 @@ def crop_audio_batch(audio):
     return torch.stack([ x[:, :size] for x in audio ])
 
 def pad_audio_batch(audio):
-    size = max(x.shape[1] for x in audio)
-    return torch.stack([ F.pad(x, (0, size-x.shape[1]), 'constant', 0) for x in audio ])
+    return pad_batch(audio)
 
 def crop_video_batch(video):
     size = min(x.shape[1] for x in video)
     return torch.stack([ x[:, :size, :, :] for x in video ])
 
 def pad_video_batch(video):
-    size = max(x.shape[1] for x in video)
-    return torch.stack([ F.pad(x, (0,0, 0,0, 0,size-x.shape[1]), 'constant', 0) for x in video ])
+    return pad_batch(video)
 
-def shuffled(xs):
-    return sorted(xs, key=lambda _: random.random())
+def pad_batch(xs):
+    "Stacks tensors into a new batch dimension, zero-padding dimension 1 to the longest."
+    size = max(x.shape[1] for x in xs)
+    shape = (len(xs), xs[0].shape[0], size, *xs[0].shape[2:])
+    if all(x.shape[1] == size for x in xs):
+        out = xs[0].new_empty(shape)
+    else:
+        out = xs[0].new_zeros(shape)
+    for i, x in enumerate(xs):
+        out[i, :, :x.shape[1]] = x
+    return out
+
+def fill_rows(xs):
+    "Concatenates tensors along dimension 0 by copying them into one preallocated tensor."
+    out = xs[0].new_empty((sum(x.shape[0] for x in xs), *xs[0].shape[1:]))
+    offset = 0
+    for x in xs:
+        out[offset:offset + x.shape[0]].copy_(x)
+        offset += x.shape[0]
+    return out
 
 def grouped(xs, key=lambda x: x):
-    return groupby(sorted(xs, key=key), key=key)
+    "Buckets xs by key in a single pass, returning (key, items) pairs in order of first occurrence."
+    buckets = defaultdict(list)
+    for x in xs:
+        buckets[key(x)].append(x)
+    return buckets.items()
                  
             
 def triu(x):
     "Extracts upper triangular part of a matrix, excluding the diagonal."
-    ones  = torch.ones_like(x)
-    return x[torch.triu(ones, diagonal=1) == 1]
+    i, j = torch.triu_indices(x.shape[0], x.shape[1], offset=1, device=x.device)
+    return x[i, j]
 
 def pearson_r(x, y, dim=0, eps=1e-8):
     "Returns Pearson's correlation coefficient."
@@ -62,4 +84,47 @@ def weighted_pearson_r(x, y, w):
     """Returns the weighted Peason's correlation coefficient:
 https://en.wikipedia.org/wiki/Pearson_correlation_coefficient#Weighted_correlation_coefficient"""
     return weighted_cov(x, y, w) / (weighted_cov(x, x, w) * weighted_cov(y, y, w))**0.5
-    
+
+
+def _read_callbacks(path):
+    """Unpickles the callback states of the zip checkpoint at `path`, reading
+    only tensors of at most one element."""
+    if not zipfile.is_zipfile(path):
+        raise ValueError(f"{path} is not a zip checkpoint")
+    with zipfile.ZipFile(path) as archive:
+        prefix = archive.namelist()[0].split('/')[0]
+
+        def rebuild_tensor(storage, offset, size, *args):
+            storage_type, key = storage
+            if torch.Size(size).numel() > 1:
+                return None
+            data = storage_type.from_buffer(archive.read(f"{prefix}/data/{key}"), 'native')
+            return torch._utils._rebuild_tensor_v2(data, offset, size, *args)
+
+        class Unpickler(pickle.Unpickler):
+            def find_class(self, module, name):
+                if (module, name) == ('torch._utils', '_rebuild_tensor_v2'):
+                    return rebuild_tensor
+                if (module, name) == ('torch._utils', '_rebuild_parameter'):
+                    return lambda data, *args: data
+                return super().find_class(module, name)
+
+            def persistent_load(self, pid):
+                kind, storage_type, key, _, _ = pid
+                if kind != 'storage':
+                    raise pickle.UnpicklingError(f"Unsupported persistent id {kind}")
+                return (storage_type, key)
+
+        return Unpickler(archive.open(f"{prefix}/data.pkl")).load()['callbacks']
+
+def checkpoint_callbacks(path):
+    """Callback states stored in the checkpoint at `path`. The model and
+    optimizer weights are not read, unless the checkpoint's layout is not
+    understood, in which case it is loaded in full."""
+    try:
+        return _read_callbacks(path)
+    except Exception as e:
+        logging.warning(f"Loading {path} in full to read its callbacks: {e!r}")
+        # Newer torch only unpickles plain tensors by default; the callback states hold classes.
+        full = {'weights_only': False} if 'weights_only' in inspect.signature(torch.load).parameters else {}
+        return torch.load(path, map_location='cpu', **full)['callbacks']
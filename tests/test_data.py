@@ -0,0 +1,55 @@
+import pickle
+
+import pytest
+import torch
+
+import pig.data
+from pig.data import Clip, PeppaPigDataset, load_cached_clip, materialize_cache, open_cache
+
+
+def clips():
+    return [ Clip(video=torch.randint(0, 256, (3, frames, 4, 5), dtype=torch.uint8),
+                  audio=torch.randn(1, samples),
+                  video_duration=duration,
+                  audio_duration=duration,
+                  filename=f"ep_{i}.avi",
+                  offset=None if i == 0 else 0.5 * i,
+                  index=i)
+             for i, (frames, samples, duration) in enumerate([(3, 100, 0.3), (7, 230, 0.7), (1, 10, 0.1)]) ]
+
+
+def check_clip(clip, expected):
+    assert torch.equal(clip.video, expected.video)
+    assert torch.equal(clip.audio, expected.audio)
+    assert clip.video_duration == expected.video_duration
+    assert clip.audio_duration == expected.audio_duration
+    assert clip.filename == expected.filename
+    assert clip.offset == expected.offset
+    assert clip.index == expected.index
+
+
+def test_cache_roundtrip(tmp_path):
+    items = clips()
+    index = materialize_cache(items, tmp_path)
+    shards = open_cache(tmp_path)
+    assert len(index) == len(items)
+    for meta, item in zip(index, items):
+        check_clip(load_cached_clip(shards, meta), item)
+
+
+def test_dataset_reads_cache(tmp_path):
+    items = clips()
+    materialize_cache(items, tmp_path)
+    pickle.dump(dict(fragment_type='narration'), open(tmp_path / "settings.pkl", "wb"))
+    dataset = PeppaPigDataset.load(str(tmp_path))
+    assert len(dataset) == len(items)
+    for i, item in enumerate(items):
+        check_clip(dataset[i], item)
+        assert dataset.meta(i).audio_duration == item.audio_duration
+    assert pickle.loads(pickle.dumps(dataset))._shards is None
+
+
+def test_dataset_rejects_legacy_cache(tmp_path):
+    torch.save(clips()[0], tmp_path / "0.pt")
+    with pytest.raises(ValueError, match="old one-file-per-item format"):
+        PeppaPigDataset(cache_dir=str(tmp_path))
@@ -0,0 +1,57 @@
+import torch
+from collections import OrderedDict
+
+import pig.util
+
+
+class Callback:
+    pass
+
+
+def checkpoint():
+    scores = torch.tensor([0.25, 0.75])
+    return {'state_dict': OrderedDict(weight=torch.randn(64, 64),
+                                      bias=torch.nn.Parameter(torch.randn(64))),
+            'optimizer_states': [{'exp_avg': torch.randn(64, 64)}],
+            'callbacks': {Callback: {'best_model_score': torch.tensor(0.5),
+                                     'current_score': scores[1],
+                                     'best_model_path': 'lightning_logs/version_0/checkpoints/last.ckpt',
+                                     'monitor': 'val_rec_fixed'}}}
+
+
+def check_callbacks(callbacks):
+    state = callbacks[Callback]
+    assert torch.equal(state['best_model_score'], torch.tensor(0.5))
+    assert torch.equal(state['current_score'], torch.tensor(0.75))
+    assert state['best_model_path'] == 'lightning_logs/version_0/checkpoints/last.ckpt'
+    assert state['monitor'] == 'val_rec_fixed'
+
+
+def test_checkpoint_callbacks_skips_full_load(tmp_path, monkeypatch):
+    path = tmp_path / "model.ckpt"
+    torch.save(checkpoint(), path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("checkpoint was loaded in full")
+
+    monkeypatch.setattr(torch, 'load', fail)
+    check_callbacks(pig.util.checkpoint_callbacks(str(path)))
+
+
+def test_checkpoint_callbacks_legacy_format(tmp_path):
+    path = tmp_path / "model.ckpt"
+    torch.save(checkpoint(), path, _use_new_zipfile_serialization=False)
+    check_callbacks(pig.util.checkpoint_callbacks(str(path)))
+
+
+def test_checkpoint_callbacks_unknown_layout(tmp_path, monkeypatch, caplog):
+    path = tmp_path / "model.ckpt"
+    torch.save(checkpoint(), path)
+
+    def removed(*args, **kwargs):
+        raise AttributeError("from_buffer")
+
+    # As if a torch upgrade changed the storage internals the reader relies on.
+    monkeypatch.setattr(torch.FloatStorage, 'from_buffer', removed)
+    check_callbacks(pig.util.checkpoint_callbacks(str(path)))
+    assert "in full" in caplog.text